@@ -2,11 +2,16 @@ import os
 import io
 import json
 import uuid
+import zlib
+import struct
 import logging
 import urllib.parse
-from typing import Any, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger()
@@ -17,11 +22,32 @@ os.environ.setdefault("NUMBA_CACHE_DIR", "/tmp/numba_cache")
 os.environ.setdefault("MPLCONFIGDIR", "/tmp/mplconfig")
 os.environ.setdefault("XDG_CACHE_HOME", "/tmp/.cache")
 
-s3 = boto3.client("s3")
+_MB = 1024 * 1024
+
+# Bodies at or above the threshold go through concurrent multipart upload
+_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8")) * _MB
+_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNK_MB", "8")) * _MB
+# Total concurrent S3 requests of one invocation, shared by the objects being uploaded
+_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "8"))
+_UPLOAD_CHECKSUM_ALGORITHM = os.getenv("S3_UPLOAD_CHECKSUM_ALGORITHM", "CRC32")
+
+# The connection pool must hold every concurrent request (botocore defaults to 10)
+s3 = boto3.client("s3", config=Config(max_pool_connections=max(10, _UPLOAD_CONCURRENCY)))
 
 _REMBG_SESSION = None
 
 
+def _transfer_config(max_concurrency: int) -> TransferConfig:
+    return TransferConfig(
+        multipart_threshold=_MULTIPART_THRESHOLD,
+        multipart_chunksize=_MULTIPART_CHUNKSIZE,
+        max_concurrency=max_concurrency,
+        use_threads=True,
+    )
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
 def _first_env(*names: str) -> Optional[str]:
     for n in names:
         v = os.getenv(n)
@@ -101,8 +127,58 @@ def _download_s3_object(bucket: str, key: str) -> bytes:
         raise
 
 
-def _upload_s3_object(bucket: str, key: str, body: bytes, content_type: str = "image/png") -> None:
-    s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType=content_type)
+def _upload_s3_object(
+    bucket: str,
+    key: str,
+    body: Union[bytes, io.BytesIO],
+    content_type: str = "image/png",
+    max_concurrency: int = _UPLOAD_CONCURRENCY,
+) -> None:
+    """
+    Small bodies are a single put_object; bodies at or above the multipart
+    threshold are uploaded as up to max_concurrency concurrent parts so a
+    transient failure only retries one part. A BytesIO is read in place (no
+    copy of the encoder output). S3 verifies the checksum of every part / object.
+    """
+    fileobj = body if isinstance(body, io.BytesIO) else io.BytesIO(body)
+    size = fileobj.getbuffer().nbytes
+    fileobj.seek(0)
+
+    if size < _MULTIPART_THRESHOLD:
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=fileobj,
+            ContentType=content_type,
+            ChecksumAlgorithm=_UPLOAD_CHECKSUM_ALGORITHM,
+        )
+        return
+
+    logger.info("multipart upload bucket=%s key=%s size=%d", bucket, key, size)
+    s3.upload_fileobj(
+        fileobj,
+        bucket,
+        key,
+        ExtraArgs={"ContentType": content_type, "ChecksumAlgorithm": _UPLOAD_CHECKSUM_ALGORITHM},
+        Config=_transfer_config(max_concurrency),
+    )
+
+
+def _upload_s3_objects(uploads: List[Tuple[str, str, Union[bytes, io.BytesIO], str]]) -> None:
+    """
+    Uploads several (bucket, key, body, content_type) outputs concurrently. The
+    _UPLOAD_CONCURRENCY budget is split between the objects, so objects x parts
+    never exceeds it (or the client's connection pool).
+    """
+    if len(uploads) == 1:
+        _upload_s3_object(*uploads[0])
+        return
+
+    workers = min(len(uploads), _UPLOAD_CONCURRENCY)
+    parts_per_object = max(1, _UPLOAD_CONCURRENCY // workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first upload failure
+        list(pool.map(lambda u: _upload_s3_object(*u, max_concurrency=parts_per_object), uploads))
 
 
 def _get_rembg_session():
@@ -123,9 +199,9 @@ def _get_rembg_session():
     return _REMBG_SESSION
 
 
-def _segment_background(image_bytes: bytes) -> bytes:
+def _segment_background(image_bytes: bytes) -> io.BytesIO:
     """
-    Returns PNG bytes with alpha channel.
+    Returns a buffer holding PNG bytes with alpha channel, positioned at 0.
     Uses a cached rembg session to avoid re-downloading / re-initializing model.
     """
     try:
@@ -137,11 +213,128 @@ def _segment_background(image_bytes: bytes) -> bytes:
     out = remove(image_bytes, session=session)
 
     if isinstance(out, (bytes, bytearray)):
-        return bytes(out)
+        return io.BytesIO(out)
 
     buf = io.BytesIO()
     out.save(buf, format="PNG")  # type: ignore[attr-defined]
-    return buf.getvalue()
+    buf.seek(0)
+    return buf
+
+
+def _use_tiled_segmentation(image_bytes: bytes) -> bool:
+    """
+    SEGMENTATION_MODE:
+      - default: full-resolution rembg.remove
+      - tiled:   always use _segment_background_tiled
+      - auto:    tiled at or above SEGMENTATION_TILED_MIN_MEGAPIXELS (default 16)
+    """
+    mode = os.getenv("SEGMENTATION_MODE", "default").lower()
+    if mode == "tiled":
+        return True
+    if mode != "auto":
+        return False
+
+    from PIL import Image  # type: ignore
+
+    # Image.open only parses the header, nothing is decoded here
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        width, height = img.size
+    return width * height >= float(os.getenv("SEGMENTATION_TILED_MIN_MEGAPIXELS", "16")) * 1_000_000
+
+
+def _png_chunk(out: io.BytesIO, tag: bytes, data: bytes) -> None:
+    out.write(struct.pack(">I", len(data)))
+    out.write(tag)
+    out.write(data)
+    out.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)) & 0xFFFFFFFF))
+
+
+def _segment_background_tiled(image_bytes: bytes) -> io.BytesIO:
+    """
+    Bounded-memory variant of _segment_background for very large images.
+
+    The mask is computed once on a reduced guide image (SEGMENTATION_GUIDE_MAX_SIDE,
+    default 1024), then upscaled with Lanczos and applied to the full-resolution
+    image SEGMENTATION_STRIP_ROWS rows at a time while the PNG is encoded
+    incrementally. Apart from the decoded source and the compressed output, only
+    strip-sized buffers are alive, instead of the full-frame RGBA/mask arrays
+    rembg.remove keeps. Output matches rembg's naive cutout (composite over
+    transparent black); a source alpha channel is kept and multiplied by the mask.
+    """
+    try:
+        import numpy as np  # type: ignore
+        from PIL import Image, ImageOps  # type: ignore
+        from rembg import remove  # type: ignore
+    except Exception as e:
+        raise RuntimeError("rembg import failed") from e
+
+    guide_max_side = int(os.getenv("SEGMENTATION_GUIDE_MAX_SIDE", "1024"))
+    strip_rows = int(os.getenv("SEGMENTATION_STRIP_ROWS", "256"))
+    session = _get_rembg_session()
+
+    # Coarse mask from a reduced copy; draft() lets JPEG decode directly at 1/2..1/8 scale
+    with Image.open(io.BytesIO(image_bytes)) as src:
+        src.draft("RGB", (guide_max_side, guide_max_side))
+        guide = ImageOps.exif_transpose(src).convert("RGB")
+    guide.thumbnail((guide_max_side, guide_max_side), Image.LANCZOS)
+    mask = remove(guide, session=session, only_mask=True)
+    if not isinstance(mask, Image.Image):
+        mask = Image.open(io.BytesIO(mask))
+    mask = mask.convert("L")
+    del guide
+
+    full = Image.open(io.BytesIO(image_bytes))
+    ImageOps.exif_transpose(full, in_place=True)
+    has_alpha = "A" in full.getbands() or "transparency" in full.info
+    mode = "RGBA" if has_alpha else "RGB"
+    if full.mode != mode:
+        full = full.convert(mode)
+    full.load()
+
+    width, height = full.size
+    scale_y = mask.height / height
+    logger.info(
+        "tiled segmentation size=%dx%d guide=%dx%d strip_rows=%d",
+        width, height, mask.width, mask.height, strip_rows,
+    )
+
+    out = io.BytesIO()
+    out.write(_PNG_SIGNATURE)
+    # 8-bit RGBA, deflate, no interlace
+    _png_chunk(out, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+    compressor = zlib.compressobj(6)
+    prev_row = np.zeros((1, width * 4), dtype=np.uint8)
+
+    for top in range(0, height, strip_rows):
+        bottom = min(height, top + strip_rows)
+        rows = bottom - top
+
+        # The box keeps the source rows outside the strip in the filter window, so strips join seamlessly
+        alpha = np.asarray(
+            mask.resize((width, rows), Image.LANCZOS, box=(0, top * scale_y, mask.width, bottom * scale_y))
+        )
+        pixels = np.asarray(full.crop((0, top, width, bottom)), dtype=np.uint16)
+
+        rgba = np.empty((rows, width, 4), dtype=np.uint8)
+        rgba[..., :3] = (pixels[..., :3] * alpha[..., None] + 127) // 255
+        # Like Image.composite in rembg, the source alpha is scaled by the mask, the colour is not premultiplied by it
+        rgba[..., 3] = (pixels[..., 3] * alpha + 127) // 255 if has_alpha else alpha
+        scanlines = rgba.reshape(rows, width * 4)
+
+        # PNG "Up" filter: each scanline minus the one above (uint8 wraps mod 256)
+        filtered = np.empty((rows, width * 4 + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        filtered[:, 1:] = scanlines - np.vstack((prev_row, scanlines[:-1]))
+        prev_row = scanlines[-1:].copy()
+
+        data = compressor.compress(filtered.tobytes())
+        if data:
+            _png_chunk(out, b"IDAT", data)
+
+    _png_chunk(out, b"IDAT", compressor.flush())
+    _png_chunk(out, b"IEND", b"")
+    out.seek(0)
+    return out
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -157,8 +350,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     logger.info("segmentation start bucket=%s input_key=%s out_key=%s", bucket, input_key, out_key)
 
     original_bytes = _download_s3_object(bucket, input_key)
-    segmented_png = _segment_background(original_bytes)
-    _upload_s3_object(bucket, out_key, segmented_png, content_type="image/png")
+    if _use_tiled_segmentation(original_bytes):
+        segmented_png = _segment_background_tiled(original_bytes)
+    else:
+        segmented_png = _segment_background(original_bytes)
+    _upload_s3_objects([(bucket, out_key, segmented_png, "image/png")])
 
     result = {
         "ok": True,
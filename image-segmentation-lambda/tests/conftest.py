@@ -0,0 +1,6 @@
+import os
+import sys
+
+# app.handler creates a boto3 client at import time; it needs a region but never credentials here
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
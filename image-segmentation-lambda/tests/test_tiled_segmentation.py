@@ -0,0 +1,79 @@
+import io
+import sys
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app import handler
+
+
+def _encode(img, fmt="PNG"):
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def _left_half_mask(img, **kwargs):
+    """Stands in for rembg.remove(only_mask=True): foreground is the left half of the guide."""
+    assert kwargs.get("only_mask")
+    mask = np.zeros((img.height, img.width), dtype=np.uint8)
+    mask[:, : img.width // 2] = 255
+    return Image.fromarray(mask, "L")
+
+
+@pytest.fixture
+def stub_rembg(monkeypatch):
+    monkeypatch.setitem(sys.modules, "rembg", types.SimpleNamespace(remove=_left_half_mask))
+    monkeypatch.setattr(handler, "_get_rembg_session", lambda: None)
+    monkeypatch.setenv("SEGMENTATION_STRIP_ROWS", "16")  # several strips plus a short last one
+
+
+def _naive_cutout(src):
+    """rembg's naive_cutout with the full-resolution stub mask."""
+    return Image.composite(src, Image.new("RGBA", src.size, 0), _left_half_mask(src, only_mask=True))
+
+
+def _source(mode, size=(96, 70)):
+    rng = np.random.default_rng(1)
+    bands = 4 if mode == "RGBA" else 3
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], bands), dtype=np.uint8), mode)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_tiled_output_matches_naive_cutout(stub_rembg, mode):
+    src = _source(mode)
+
+    with Image.open(handler._segment_background_tiled(_encode(src))) as out:
+        assert out.format == "PNG"
+        assert out.size == src.size
+        assert out.mode == "RGBA"
+        pixels = np.asarray(out, dtype=np.int16)
+
+    expected = np.asarray(_naive_cutout(src), dtype=np.int16)
+    assert np.abs(pixels - expected).max() <= 1
+
+
+def test_tiled_keeps_source_transparency(stub_rembg):
+    src = _source("RGBA")
+    src.putalpha(0)
+
+    with Image.open(handler._segment_background_tiled(_encode(src))) as out:
+        alpha = np.asarray(out)[..., 3]
+
+    # the mask keeps the left half, but the source is fully transparent there too
+    assert alpha.max() == 0
+
+
+def test_tiled_downscaled_guide(stub_rembg, monkeypatch):
+    monkeypatch.setenv("SEGMENTATION_GUIDE_MAX_SIDE", "32")
+    src = _source("RGB", size=(320, 200))
+
+    with Image.open(handler._segment_background_tiled(_encode(src, "JPEG"))) as out:
+        assert out.size == (320, 200)
+        alpha = np.asarray(out)[..., 3]
+
+    # the upscaled guide mask only blurs around the boundary in the middle
+    assert (alpha[:, :120] == 255).all()
+    assert (alpha[:, 200:] == 0).all()
@@ -0,0 +1,89 @@
+import io
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
+
+from app import handler
+
+
+class FakeTransferClient:
+    """Records upload_fileobj calls; put_object goes to the real (stubbed) client."""
+
+    def __init__(self, fail_keys=()):
+        self.uploads = []
+        self.fail_keys = set(fail_keys)
+        self.lock = threading.Lock()
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        if key in self.fail_keys:
+            raise ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate."}}, "UploadPart")
+        with self.lock:
+            self.uploads.append({
+                "fileobj": fileobj, "position": fileobj.tell(), "bucket": bucket, "key": key,
+                "extra_args": ExtraArgs, "config": Config,
+            })
+
+
+@pytest.fixture
+def small_threshold(monkeypatch):
+    monkeypatch.setattr(handler, "_MULTIPART_THRESHOLD", 1024)
+
+
+@pytest.fixture
+def fake_transfer(monkeypatch, small_threshold):
+    fake = FakeTransferClient()
+    monkeypatch.setattr(handler, "s3", fake)
+    return fake
+
+
+def test_small_body_is_one_put_object_with_a_checksum(small_threshold):
+    with Stubber(handler.s3) as stubber:
+        stubber.add_response("put_object", {}, {
+            "Bucket": "closet", "Key": "out.png", "Body": ANY,
+            "ContentType": "image/png", "ChecksumAlgorithm": "CRC32",
+        })
+        handler._upload_s3_object("closet", "out.png", b"\x89PNG" * 10)
+        stubber.assert_no_pending_responses()
+
+
+def test_body_at_the_threshold_is_multipart_from_the_same_buffer(fake_transfer):
+    body = io.BytesIO(b"x" * 1024)
+    body.seek(512)  # the encoder leaves the position anywhere
+    handler._upload_s3_object("closet", "out.png", body)
+
+    (upload,) = fake_transfer.uploads
+    assert upload["fileobj"] is body
+    assert upload["position"] == 0
+    assert upload["extra_args"] == {"ContentType": "image/png", "ChecksumAlgorithm": "CRC32"}
+    assert upload["config"].multipart_threshold == 1024
+    assert upload["config"].max_concurrency == handler._UPLOAD_CONCURRENCY
+
+
+def test_bytes_body_above_the_threshold_is_multipart(fake_transfer):
+    handler._upload_s3_object("closet", "out.png", b"x" * 4096, "image/webp")
+
+    (upload,) = fake_transfer.uploads
+    assert upload["fileobj"].getvalue() == b"x" * 4096
+    assert upload["extra_args"]["ContentType"] == "image/webp"
+
+
+def test_several_uploads_share_the_concurrency_budget(fake_transfer):
+    uploads = [("closet", "out-%d.png" % i, io.BytesIO(b"x" * 2048), "image/png") for i in range(4)]
+    handler._upload_s3_objects(uploads)
+
+    assert sorted(u["key"] for u in fake_transfer.uploads) == ["out-0.png", "out-1.png", "out-2.png", "out-3.png"]
+    assert all(u["config"].max_concurrency * 4 <= handler._UPLOAD_CONCURRENCY for u in fake_transfer.uploads)
+
+
+def test_failed_upload_is_raised(monkeypatch, small_threshold):
+    monkeypatch.setattr(handler, "s3", FakeTransferClient(fail_keys={"out-1.png"}))
+    uploads = [("closet", "out-%d.png" % i, b"x" * 2048, "image/png") for i in range(3)]
+
+    with pytest.raises(ClientError, match="SlowDown"):
+        handler._upload_s3_objects(uploads)
+
+
+def test_connection_pool_holds_every_concurrent_request():
+    assert handler.s3.meta.config.max_pool_connections >= handler._UPLOAD_CONCURRENCY
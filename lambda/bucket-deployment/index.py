@@ -0,0 +1,852 @@
+# Site deployment custom resource handler.
+#
+# Started as a copy of the aws-cdk-lib aws-s3-deployment (BucketDeployment) handler and is owned here,
+# so changes are not lost when `cdk synth` regenerates cdk.out. Deployed by
+# lib/site-deployment/SiteDeploymentConstruct.ts (AwsCliLayer provides /opt/awscli/aws).
+import contextlib
+import fnmatch
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import re
+import tempfile
+import time
+import urllib.parse
+from urllib.request import Request, urlopen
+from uuid import uuid4
+from zipfile import ZipFile
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import WaiterError
+
+try:
+    import brotli # optional, not part of the lambda python runtime (add it with a layer)
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+cloudfront = boto3.client('cloudfront', config=Config(
+    retries = {
+        'max_attempts': 10,
+        'mode': 'standard',
+    }
+))
+s3 = boto3.client('s3')
+
+CFN_SUCCESS = "SUCCESS"
+CFN_FAILED = "FAILED"
+ENV_KEY_MOUNT_PATH = "MOUNT_PATH"
+ENV_KEY_SKIP_CLEANUP = "SKIP_CLEANUP"
+
+AWS_CLI_CONFIG_FILE = "/tmp/aws_cli_config"
+CUSTOM_RESOURCE_OWNER_TAG = "aws-cdk:cr-owned"
+
+# CloudFront allows 3000 paths (15 of them wildcards) in progress per distribution and bills every path;
+# planned invalidations stay well below that so overlapping deploys do not hit TooManyInvalidationsInProgress
+INVALIDATION_PATH_BUDGET = 100
+INVALIDATION_WILDCARD_BUDGET = 5
+# a directory with more changed paths than this is invalidated with one "dir/*" wildcard
+INVALIDATION_COLLAPSE_THRESHOLD = 4
+
+# cache policies applied when "ContentAwareCaching" is enabled
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+NO_CACHE_CONTROL = "no-cache"
+
+# content hashes in bundler output names. Rollup/vite hashes are arbitrary base64url, so any 8-char segment
+# counts ("vendor-react18x.js" too); "Fingerprinted" rules rely on "Include" to limit them to the bundler's output
+FINGERPRINT_PATTERNS = [
+    # webpack / CRA: "main.3f2a9c1b.js", "app.5d41402abc4b2a76b9719d911017c592.css" - lowercase hex run of 8+
+    re.compile(r"[.-][0-9a-f]{8,}\.[A-Za-z0-9]+$"),
+    # vite / rollup: "index-BxY3z9aQ.js", "index-Dk3_-Qz9.js" - 8 base64url chars
+    re.compile(r"-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$"),
+]
+
+# "PrecompressEncoding" stores these files compressed, under their own key, when that makes them smaller
+COMPRESSIBLE_EXTENSIONS = (".html", ".htm", ".css", ".js", ".mjs", ".json", ".map", ".svg", ".txt", ".xml", ".wasm", ".ico")
+MIN_COMPRESS_SIZE = 1024
+PRECOMPRESS_ENCODINGS = ("gzip", "br")
+
+# entry points reference the other files of the site, so they are uploaded after everything else
+ENTRY_POINT_EXTENSIONS = (".html", ".htm")
+
+# "aws s3 cp/sync" defaults (multipart_threshold / multipart_chunksize), which decide the ETag format
+CLI_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+CLI_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+# properties that change what an unchanged file must look like in the destination; if any of them
+# changed since the last deploy every file is uploaded again
+SKIP_UNCHANGED_GUARD_PROPS = [
+    'DestinationBucketName', 'DestinationBucketKeyPrefix', 'UserMetadata', 'SystemMetadata',
+    'MetadataRules', 'ContentAwareCaching', 'PrecompressEncoding',
+]
+
+# CloudWatch embedded metric format namespace for the deployment report
+METRICS_NAMESPACE = "CDK/BucketDeployment"
+
+os.putenv('AWS_CONFIG_FILE', AWS_CLI_CONFIG_FILE)
+
+def handler(event, context):
+
+    metrics = DeployMetrics()
+
+    def cfn_error(message=None):
+        if message:
+            logger.error("| cfn_error: %s" % message.encode())
+        metrics.emit()
+        cfn_send(event, context, CFN_FAILED, reason=message, physicalResourceId=event.get('PhysicalResourceId', None),
+                 responseData={'Metrics': metrics.as_dict()})
+
+
+    try:
+        # We are not logging ResponseURL as this is a pre-signed S3 URL, and could be used to tamper
+        # with the response CloudFormation sees from this Custom Resource execution.
+        logger.info({ key:value for (key, value) in event.items() if key != 'ResponseURL'})
+
+        # cloudformation request type (create/update/delete)
+        request_type = event['RequestType']
+
+        # extract resource properties
+        props = event['ResourceProperties']
+        old_props = event.get('OldResourceProperties', {})
+        physical_id = event.get('PhysicalResourceId', None)
+
+        try:
+            source_bucket_names = props['SourceBucketNames']
+            source_object_keys  = props['SourceObjectKeys']
+            source_markers      = props.get('SourceMarkers', None)
+            source_markers_config = props.get('SourceMarkersConfig', None)
+            dest_bucket_name    = props['DestinationBucketName']
+            dest_bucket_prefix  = props.get('DestinationBucketKeyPrefix', '')
+            extract             = props.get('Extract', 'true') == 'true'
+            retain_on_delete    = props.get('RetainOnDelete', "true") == "true"
+            distribution_id     = props.get('DistributionId', '')
+            # CloudFormation passes booleans through as strings
+            wait_for_distribution_invalidation = str(props.get('WaitForDistributionInvalidation', 'true')).lower() == 'true'
+            user_metadata       = props.get('UserMetadata', {})
+            system_metadata     = props.get('SystemMetadata', {})
+            prune               = props.get('Prune', 'true').lower() == 'true'
+            exclude             = props.get('Exclude', [])
+            include             = props.get('Include', [])
+            sign_content        = props.get('SignContent', 'false').lower() == 'true'
+            output_object_keys  = props.get('OutputObjectKeys', 'true') == 'true'
+            targeted_invalidation = props.get('TargetedInvalidation', 'false').lower() == 'true'
+            metadata_rules      = props.get('MetadataRules', [])
+            content_aware_caching = props.get('ContentAwareCaching', 'false').lower() == 'true'
+            skip_unchanged      = props.get('SkipUnchangedObjects', 'true').lower() == 'true'
+            precompress_encoding = props.get('PrecompressEncoding', '')
+
+            # backwards compatibility - if "SourceMarkers" is not specified,
+            # assume all sources have an empty market map
+            if source_markers is None:
+                source_markers = [{} for i in range(len(source_bucket_names))]
+            if source_markers_config is None:
+                source_markers_config = [{} for i in range(len(source_bucket_names))]
+
+            default_distribution_path = dest_bucket_prefix
+            if not default_distribution_path.endswith("/"):
+                default_distribution_path += "/"
+            if not default_distribution_path.startswith("/"):
+                default_distribution_path = "/" + default_distribution_path
+            default_distribution_path += "*"
+
+            explicit_distribution_paths = 'DistributionPaths' in props
+            distribution_paths = props.get('DistributionPaths', [default_distribution_path])
+
+            if content_aware_caching:
+                metadata_rules = metadata_rules + default_metadata_rules()
+        except KeyError as e:
+            cfn_error("missing request resource property %s. props: %s" % (str(e), props))
+            return
+
+        # configure aws cli options after resetting back to the defaults for each request
+        if os.path.exists(AWS_CLI_CONFIG_FILE):
+                os.remove(AWS_CLI_CONFIG_FILE)
+        if sign_content:
+                aws_command("configure", "set", "default.s3.payload_signing_enabled", "true")
+
+        # treat "/" as if no prefix was specified
+        if dest_bucket_prefix == "/":
+            dest_bucket_prefix = ""
+
+        s3_source_zips = list(map(lambda name, key: "s3://%s/%s" % (name, key), source_bucket_names, source_object_keys))
+        s3_dest = "s3://%s/%s" % (dest_bucket_name, dest_bucket_prefix)
+        old_s3_dest = "s3://%s/%s" % (old_props.get("DestinationBucketName", ""), old_props.get("DestinationBucketKeyPrefix", ""))
+
+
+        # obviously this is not
+        if old_s3_dest == "s3:///":
+            old_s3_dest = None
+
+        logger.info("| s3_dest: %s" % sanitize_message(s3_dest))
+        logger.info("| old_s3_dest: %s" % sanitize_message(old_s3_dest))
+
+        # if we are creating a new resource, allocate a physical id for it
+        # otherwise, we expect physical id to be relayed by cloudformation
+        if request_type == "Create":
+            physical_id = "aws.cdk.s3deployment.%s" % str(uuid4())
+        else:
+            if not physical_id:
+                cfn_error("invalid request: request type is '%s' but 'PhysicalResourceId' is not defined" % request_type)
+                return
+
+        # delete or create/update (only if "retain_on_delete" is false)
+        if request_type == "Delete" and not retain_on_delete:
+            if not bucket_owned(dest_bucket_name, dest_bucket_prefix):
+                aws_command("s3", "rm", s3_dest, "--recursive")
+
+        # if we are updating without retention and the destination changed, delete first
+        if request_type == "Update" and not retain_on_delete and old_s3_dest != s3_dest:
+            if not old_s3_dest:
+                logger.warn("cannot delete old resource without old resource properties")
+                return
+
+            aws_command("s3", "rm", old_s3_dest, "--recursive")
+
+        # only plan invalidation paths from the sync when the user did not pin them explicitly
+        track_changes = bool(distribution_id) and targeted_invalidation and not explicit_distribution_paths
+        changed_keys = None
+
+        # objects already in the destination can only be kept as they are if they were written with the same metadata
+        skip_unchanged = skip_unchanged and request_type == "Update" and all(
+            props.get(k) == old_props.get(k) for k in SKIP_UNCHANGED_GUARD_PROPS)
+
+        if request_type == "Update" or request_type == "Create":
+            changed_keys = s3_deploy(s3_source_zips, s3_dest, user_metadata, system_metadata, prune, exclude, include, source_markers, extract, source_markers_config, track_changes, metadata_rules, metrics, skip_unchanged, precompress_encoding)
+
+        if distribution_id and changed_keys is not None:
+            distribution_paths = plan_invalidation_paths(changed_keys, dest_bucket_prefix)
+            logger.info("| planned %d invalidation path(s) for %d changed key(s)" % (len(distribution_paths), len(changed_keys)))
+
+        if distribution_id and distribution_paths:
+            cloudfront_invalidate(distribution_id, distribution_paths, wait_for_distribution_invalidation, metrics)
+        elif distribution_id:
+            logger.info("| no changed objects, skipping cloudfront invalidation")
+
+        metrics.emit()
+        cfn_send(event, context, CFN_SUCCESS, physicalResourceId=physical_id, responseData={
+            # Passing through the ARN sequences dependencees on the deployment
+            'DestinationBucketArn': props.get('DestinationBucketArn'),
+            **({'SourceObjectKeys': props.get('SourceObjectKeys')} if output_object_keys else {'SourceObjectKeys': []}),
+            'Metrics': metrics.as_dict(),
+        })
+    except KeyError as e:
+        cfn_error("invalid request. Missing key %s" % str(e))
+    except Exception as e:
+        logger.exception(e)
+        cfn_error(str(e))
+
+#---------------------------------------------------------------------------------------------------
+# per-phase timers and byte/file counters for a single deployment
+class DeployMetrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.seconds = {}
+        self.counters = {}
+
+    # accumulate the wall time spent in a phase (phases such as "Download" repeat per source)
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+            logger.info("| phase %s: %.3fs" % (name, elapsed))
+
+    def add(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        result = { "%sSeconds" % name: round(value, 3) for name, value in self.seconds.items() }
+        result["TotalSeconds"] = round(time.monotonic() - self.started, 3)
+        result.update(self.counters)
+        sync_seconds = self.seconds.get("Sync", 0.0)
+        if sync_seconds > 0 and "BytesUploaded" in self.counters:
+            result["UploadBytesPerSecond"] = round(self.counters["BytesUploaded"] / sync_seconds)
+        return result
+
+    # print the report in CloudWatch embedded metric format; it has to be a raw stdout line, not a log record
+    def emit(self):
+        values = self.as_dict()
+        def unit(name):
+            if name.endswith("Seconds"): return "Seconds"
+            if name.endswith("PerSecond"): return "Bytes/Second"
+            if name.startswith("Bytes"): return "Bytes"
+            return "Count"
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [[]],
+                    "Metrics": [{ "Name": name, "Unit": unit(name) } for name in values],
+                }],
+            },
+            **values,
+        }), flush=True)
+
+#---------------------------------------------------------------------------------------------------
+# Sanitize the message to mitigate CWE-117 and CWE-93 vulnerabilities
+def sanitize_message(message):
+    if not message:
+        return message
+
+    # Sanitize the message to prevent log injection and HTTP response splitting
+    sanitized_message = message.replace('\n', '').replace('\r', '')
+
+    # Encode the message to handle special characters
+    encoded_message = urllib.parse.quote(sanitized_message)
+
+    return encoded_message
+
+#---------------------------------------------------------------------------------------------------
+# populate all files from s3_source_zips to a destination bucket
+# returns the changed and deleted destination keys when "track_changes" is set, otherwise None
+def s3_deploy(s3_source_zips, s3_dest, user_metadata, system_metadata, prune, exclude, include, source_markers, extract, source_markers_config, track_changes=False, metadata_rules=[], metrics=None, skip_unchanged=False, precompress_encoding=None):
+    metrics = metrics or DeployMetrics()
+
+    # list lengths are equal
+    if len(s3_source_zips) != len(source_markers):
+        raise Exception("'source_markers' and 's3_source_zips' must be the same length")
+
+    # create a temporary working directory in /tmp or if enabled an attached efs volume
+    if ENV_KEY_MOUNT_PATH in os.environ:
+        workdir = os.getenv(ENV_KEY_MOUNT_PATH) + "/" + str(uuid4())
+        os.mkdir(workdir)
+    else:
+        workdir = tempfile.mkdtemp()
+
+    logger.info("| workdir: %s" % workdir)
+
+    # create a directory into which we extract the contents of the zip file
+    contents_dir=os.path.join(workdir, 'contents')
+    os.mkdir(contents_dir)
+
+    try:
+        # download the archive from the source and extract to "contents"
+        for i in range(len(s3_source_zips)):
+            s3_source_zip = s3_source_zips[i]
+            markers       = source_markers[i]
+            markers_config = source_markers_config[i]
+
+            metrics.add("SourceArchives")
+            if extract:
+                archive=os.path.join(workdir, str(uuid4()))
+                logger.info("archive: %s" % archive)
+                with metrics.phase("Download"):
+                    aws_command("s3", "cp", s3_source_zip, archive)
+                metrics.add("BytesDownloaded", os.path.getsize(archive))
+                logger.info("| extracting archive to: %s\n" % contents_dir)
+                logger.info("| markers: %s" % markers)
+                extract_and_replace_markers(archive, contents_dir, markers, markers_config, metrics)
+            else:
+                logger.info("| copying archive to: %s\n" % contents_dir)
+                with metrics.phase("Download"):
+                    aws_command("s3", "cp", s3_source_zip, contents_dir)
+                metrics.add("BytesDownloaded", os.path.getsize(os.path.join(contents_dir, posixpath.basename(s3_source_zip))))
+
+        # replace compressible files by their compressed body, uploaded under the same key with "Content-Encoding"
+        compressed = set()
+        if precompress_encoding:
+            with metrics.phase("Precompress"):
+                compressed = compress_files(contents_dir, precompress_encoding, exclude, include)
+            metrics.add("FilesCompressed", len(compressed))
+
+        # extracted files all carry the current time, so "sync" would upload every one of them;
+        # backdate the files whose content already matches the destination object so it skips them
+        if skip_unchanged:
+            with metrics.phase("ChangeDetection"):
+                _, dest_prefix = split_s3_dest(s3_dest)
+                metrics.add("FilesUnchanged", mark_unchanged_files(contents_dir, dest_prefix, list_object_etags(s3_dest)))
+
+        uploaded_keys = set()
+        deleted_keys = set()
+        with metrics.phase("Sync"):
+            if metadata_rules or compressed:
+                # one sync per batch of files sharing their metadata, from a staging directory holding only
+                # that batch; entry points come last so they never reference files that are not uploaded yet
+                for batch_index, (rule, encoded, files) in enumerate(plan_upload_batches(contents_dir, metadata_rules, compressed)):
+                    staging_dir = stage_files(contents_dir, os.path.join(workdir, "batch-%d" % batch_index), files)
+                    batch_system_metadata = merge_metadata(system_metadata, (rule or {}).get('SystemMetadata', {}))
+                    if encoded:
+                        batch_system_metadata['content-encoding'] = precompress_encoding
+                    uploaded, _ = parse_sync_output(aws_command_output(*create_sync_command(
+                        staging_dir, s3_dest, False, exclude, include,
+                        merge_metadata(user_metadata, (rule or {}).get('UserMetadata', {})), batch_system_metadata)))
+                    uploaded_keys |= uploaded
+                    if rule is not None:
+                        metrics.add("FilesMatchedByRules", len(files))
+
+                # everything is in place with its own metadata; the pruning pass below must not upload again
+                for root, _, files in os.walk(contents_dir):
+                    for name in files:
+                        os.utime(os.path.join(root, name), (0, 0))
+
+            # sync from "contents" to destination
+            if prune or not (metadata_rules or compressed):
+                uploaded, deleted_keys = parse_sync_output(aws_command_output(*create_sync_command(
+                    contents_dir, s3_dest, prune, exclude, include, user_metadata, system_metadata)))
+                uploaded_keys |= uploaded
+
+        _, dest_prefix = split_s3_dest(s3_dest)
+        metrics.add("FilesUploaded", len(uploaded_keys))
+        metrics.add("FilesDeleted", len(deleted_keys))
+        metrics.add("BytesUploaded", sum(
+            os.path.getsize(path) for path in (os.path.join(contents_dir, key[len(dest_prefix):]) for key in uploaded_keys)
+            if os.path.isfile(path)))
+
+        if not track_changes:
+            return None
+        return sorted(uploaded_keys | deleted_keys)
+    finally:
+        if not os.getenv(ENV_KEY_SKIP_CLEANUP):
+            shutil.rmtree(workdir)
+
+#---------------------------------------------------------------------------------------------------
+# invalidate files in the CloudFront distribution edge caches
+def cloudfront_invalidate(distribution_id, distribution_paths, wait_for_invalidation, metrics=None):
+    metrics = metrics or DeployMetrics()
+    metrics.add("InvalidationPaths", len(distribution_paths))
+    with metrics.phase("Invalidation"):
+        invalidation_resp = cloudfront.create_invalidation(
+            DistributionId=distribution_id,
+            InvalidationBatch={
+                'Paths': {
+                    'Quantity': len(distribution_paths),
+                    'Items': distribution_paths
+                },
+                'CallerReference': str(uuid4()),
+            })
+    if wait_for_invalidation:
+        try:
+            # Wait for a maximum of 13 minutes for invalidation to complete.
+            with metrics.phase("InvalidationWait"):
+                cloudfront.get_waiter('invalidation_completed').wait(
+                    DistributionId=distribution_id,
+                    Id=invalidation_resp['Invalidation']['Id'],
+                    WaiterConfig={
+                        'Delay': 20,
+                        'MaxAttempts': (13*60)//20,
+                    }
+                )
+        except WaiterError as e:
+            raise RuntimeError(f"Unable to confirm that cache invalidation was successful. This may be a CloudFront regression as reported in https://github.com/aws/aws-cdk/issues/15891") from e
+
+
+#---------------------------------------------------------------------------------------------------
+# extract the destination keys uploaded or deleted by "aws s3 sync" from its output, e.g.
+#   upload: ../contents/index.html to s3://bucket/site/index.html
+#   delete: s3://bucket/site/old.js
+# returns a tuple of (uploaded keys, deleted keys)
+def parse_sync_output(output):
+    uploaded = set()
+    deleted = set()
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith("upload: ") or line.startswith("copy: "):
+            # split on the destination URL, not " to ", which may also appear in the file name
+            source, sep, dest = line.partition(" to s3://")
+            if not sep:
+                logger.warning("| unable to parse sync output line: %s" % sanitize_message(line))
+                continue
+            keys, dest = uploaded, "s3://" + dest
+        elif line.startswith("delete: "):
+            keys, dest = deleted, line[len("delete: "):]
+        else:
+            continue
+        if not dest.startswith("s3://"):
+            continue
+        # strip "s3://bucket/"
+        keys.add(dest[len("s3://"):].split("/", 1)[-1])
+    return uploaded, deleted
+
+#---------------------------------------------------------------------------------------------------
+# collapse changed object keys into a minimal list of invalidation paths: bottom-up, every directory
+# with more than "collapse_threshold" changed paths becomes one wildcard; if the result is still over
+# budget the whole destination prefix is invalidated
+def plan_invalidation_paths(changed_keys, dest_bucket_prefix, max_paths=INVALIDATION_PATH_BUDGET,
+                            max_wildcards=INVALIDATION_WILDCARD_BUDGET, collapse_threshold=INVALIDATION_COLLAPSE_THRESHOLD):
+    prefix = dest_bucket_prefix.strip("/")
+    root_dir = "/" + prefix if prefix else ""
+    root_wildcard = [urllib.parse.quote(root_dir + "/*", safe="/*")]
+
+    def parent(directory):
+        directory = posixpath.dirname(directory)
+        return "" if directory == "/" else directory
+
+    # paths directly under each directory; every directory between a key and the prefix is visited
+    entries = {}
+    directories = set()
+    for key in changed_keys:
+        path = "/" + key.lstrip("/")
+        directory = parent(path)
+        entries.setdefault(directory, []).append(path)
+        # "dir/index.html" is also served as "dir/"
+        if posixpath.basename(path) == "index.html":
+            entries[directory].append(directory + "/")
+        if directory != root_dir and not directory.startswith(root_dir + "/"):
+            return root_wildcard
+        while directory != root_dir:
+            directories.add(directory)
+            directory = parent(directory)
+
+    # deepest first, so collapsed subdirectories count as a single path in their parent
+    for directory in sorted(directories, key=lambda d: d.count("/"), reverse=True):
+        under = entries.pop(directory, [])
+        if len(under) > collapse_threshold:
+            under = [directory + "/*"]
+        entries.setdefault(parent(directory), []).extend(under)
+
+    paths = sorted(set(entries.get(root_dir, [])))
+    if len(paths) > max_paths or sum(1 for p in paths if p.endswith("*")) > max_wildcards:
+        return root_wildcard
+    return [urllib.parse.quote(p, safe="/*") for p in paths]
+
+#---------------------------------------------------------------------------------------------------
+# built-in rules for "ContentAwareCaching": HTML entry points are revalidated on every request,
+# fingerprinted assets are cached forever
+# (only hashed names in the bundler's "assets/" output directory count as fingerprinted)
+def default_metadata_rules():
+    return [
+        { 'Include': ['*.html', '*.htm'], 'SystemMetadata': { 'cache-control': NO_CACHE_CONTROL } },
+        { 'Include': ['assets/*'], 'Fingerprinted': 'true', 'SystemMetadata': { 'cache-control': IMMUTABLE_CACHE_CONTROL } },
+    ]
+
+def is_fingerprinted(relative_key):
+    name = posixpath.basename(relative_key)
+    return any(pattern.search(name) for pattern in FINGERPRINT_PATTERNS)
+
+#---------------------------------------------------------------------------------------------------
+# returns the first rule matching a key relative to the destination prefix, or None; a rule matches
+# when the key matches one of its "Include" globs (if any) and, with "Fingerprinted", carries a content hash
+def match_metadata_rule(relative_key, metadata_rules):
+    for rule in metadata_rules:
+        globs = rule.get('Include', [])
+        if globs and not any(fnmatch.fnmatchcase(relative_key, pattern) for pattern in globs):
+            continue
+        if str(rule.get('Fingerprinted', 'false')).lower() == 'true' and not is_fingerprinted(relative_key):
+            continue
+        return rule
+    return None
+
+#---------------------------------------------------------------------------------------------------
+# mirror the "--exclude"/"--include" filters passed to "aws s3 sync" (later filters take precedence)
+def is_synced(relative_key, exclude, include):
+    synced = True
+    for pattern in exclude:
+        if fnmatch.fnmatchcase(relative_key, pattern):
+            synced = False
+    for pattern in include:
+        if fnmatch.fnmatchcase(relative_key, pattern):
+            synced = True
+    return synced
+
+#---------------------------------------------------------------------------------------------------
+# split the files in contents_dir into upload batches, [(matching metadata rule or None, compressed, [relative paths])];
+# files matched by a rule come first in rule order, then unmatched files, then entry points in the same order
+def plan_upload_batches(contents_dir, metadata_rules, compressed=()):
+    batches = {}
+    for root, _, files in os.walk(contents_dir):
+        for name in files:
+            relative_key = os.path.relpath(os.path.join(root, name), contents_dir).replace(os.sep, "/")
+            rule = match_metadata_rule(relative_key, metadata_rules)
+            rule_index = len(metadata_rules) if rule is None else next(i for i, r in enumerate(metadata_rules) if r is rule)
+            entry_point = name.lower().endswith(ENTRY_POINT_EXTENSIONS)
+            batches.setdefault((entry_point, rule_index, relative_key in compressed), []).append(relative_key)
+    return [(metadata_rules[rule_index] if rule_index < len(metadata_rules) else None, encoded, files)
+            for (_, rule_index, encoded), files in sorted(batches.items())]
+
+#---------------------------------------------------------------------------------------------------
+# compress the synced, compressible files in contents_dir in place with "encoding" ("gzip" or "br"), keeping
+# the original where compression does not help; returns the relative paths of the compressed files
+def compress_files(contents_dir, encoding, exclude, include):
+    if encoding not in PRECOMPRESS_ENCODINGS:
+        raise Exception("unsupported pre-compression encoding '%s'" % encoding)
+    if encoding == "br" and brotli is None:
+        raise Exception("pre-compression with 'br' requires the brotli module")
+
+    compressed = set()
+    for root, _, files in os.walk(contents_dir):
+        for name in files:
+            file_path = os.path.join(root, name)
+            relative_key = os.path.relpath(file_path, contents_dir).replace(os.sep, "/")
+            if not name.lower().endswith(COMPRESSIBLE_EXTENSIONS) or not is_synced(relative_key, exclude, include):
+                continue
+            if os.path.getsize(file_path) < MIN_COMPRESS_SIZE:
+                continue
+
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            # mtime=0 keeps gzip output (and so the ETag) stable across deploys
+            body = gzip.compress(data, mtime=0) if encoding == "gzip" else brotli.compress(data)
+            if len(body) >= len(data):
+                continue
+            with open(file_path, 'wb') as f:
+                f.write(body)
+            compressed.add(relative_key)
+    return compressed
+
+#---------------------------------------------------------------------------------------------------
+# hard link (or copy, keeping mtimes) the given files from contents_dir into staging_dir
+def stage_files(contents_dir, staging_dir, files):
+    for file in files:
+        source = os.path.join(contents_dir, file)
+        target = os.path.join(staging_dir, file)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+    return staging_dir
+
+#---------------------------------------------------------------------------------------------------
+# combine metadata, keys of "overrides" win (keys are case-insensitive)
+def merge_metadata(metadata, overrides):
+    merged = { k.lower(): v for k, v in metadata.items() }
+    merged.update({ k.lower(): v for k, v in overrides.items() })
+    return merged
+
+#---------------------------------------------------------------------------------------------------
+# "aws s3 sync" arguments for syncing source_dir to s3_dest
+def create_sync_command(source_dir, s3_dest, prune, exclude, include, user_metadata, system_metadata):
+    s3_command = ["s3", "sync"]
+
+    if prune:
+      s3_command.append("--delete")
+
+    if exclude:
+      for filter in exclude:
+        s3_command.extend(["--exclude", filter])
+
+    if include:
+      for filter in include:
+        s3_command.extend(["--include", filter])
+
+    s3_command.extend([source_dir, s3_dest])
+    s3_command.extend(create_metadata_args(user_metadata, system_metadata))
+    s3_command.append("--no-progress")
+    return s3_command
+
+#---------------------------------------------------------------------------------------------------
+# ETag S3 reports for a file uploaded by the aws cli: MD5 of the body, or for multipart uploads the
+# MD5 of the part MD5s followed by "-<parts>" (objects encrypted with SSE-KMS never match, which is safe)
+def local_etag(file_path):
+    digests = []
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CLI_MULTIPART_CHUNKSIZE), b''):
+            digests.append(hashlib.md5(chunk).digest())
+    if os.path.getsize(file_path) < CLI_MULTIPART_THRESHOLD:
+        return (digests[0] if digests else hashlib.md5(b'').digest()).hex()
+    return "%s-%d" % (hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+
+#---------------------------------------------------------------------------------------------------
+# returns { key: etag } for every object under the destination
+def list_object_etags(s3_dest):
+    bucket, dest_prefix = split_s3_dest(s3_dest)
+    etags = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=dest_prefix):
+        for obj in page.get('Contents', []):
+            etags[obj['Key']] = obj['ETag'].strip('"')
+    return etags
+
+#---------------------------------------------------------------------------------------------------
+# set the mtime of files identical to their destination object to the epoch, so that "sync" (which
+# uploads when the size differs or the local file is newer) leaves them alone; returns the count
+def mark_unchanged_files(contents_dir, dest_prefix, remote_etags):
+    unchanged = 0
+    for root, _, files in os.walk(contents_dir):
+        for name in files:
+            file_path = os.path.join(root, name)
+            key = dest_prefix + os.path.relpath(file_path, contents_dir).replace(os.sep, "/")
+            etag = remote_etags.get(key)
+            if etag is not None and etag == local_etag(file_path):
+                os.utime(file_path, (0, 0))
+                unchanged += 1
+    return unchanged
+
+#---------------------------------------------------------------------------------------------------
+# split "s3://bucket/prefix" into the bucket and the key prefix of the synced objects ("prefix/")
+def split_s3_dest(s3_dest):
+    bucket, _, dest_prefix = s3_dest[len("s3://"):].partition("/")
+    if dest_prefix and not dest_prefix.endswith("/"):
+        dest_prefix += "/"
+    return bucket, dest_prefix
+
+#---------------------------------------------------------------------------------------------------
+# set metadata
+def create_metadata_args(raw_user_metadata, raw_system_metadata):
+    if len(raw_user_metadata) == 0 and len(raw_system_metadata) == 0:
+        return []
+
+    format_system_metadata_key = lambda k: k.lower()
+    format_user_metadata_key = lambda k: k.lower()
+
+    system_metadata = { format_system_metadata_key(k): v for k, v in raw_system_metadata.items() }
+    user_metadata = { format_user_metadata_key(k): v for k, v in raw_user_metadata.items() }
+
+    flatten = lambda l: [item for sublist in l for item in sublist]
+    system_args = flatten([[f"--{k}", v] for k, v in system_metadata.items()])
+    user_args = ["--metadata", json.dumps(user_metadata, separators=(',', ':'))] if len(user_metadata) > 0 else []
+
+    return system_args + user_args + ["--metadata-directive", "REPLACE"]
+
+#---------------------------------------------------------------------------------------------------
+# executes an "aws" cli command
+def aws_command(*args):
+    aws="/opt/awscli/aws" # from AwsCliLayer
+    logger.info("| aws %s" % ' '.join(args))
+    subprocess.check_call([aws] + list(args))
+
+#---------------------------------------------------------------------------------------------------
+# executes an "aws" cli command, logging its stdout as it is produced, and returns the stdout
+def aws_command_output(*args):
+    aws="/opt/awscli/aws" # from AwsCliLayer
+    logger.info("| aws %s" % ' '.join(args))
+    lines = []
+    with subprocess.Popen([aws] + list(args), stdout=subprocess.PIPE) as process:
+        for line in process.stdout:
+            line = line.decode('utf-8', errors='replace').rstrip('\n')
+            logger.info(line)
+            lines.append(line)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, [aws] + list(args))
+    return '\n'.join(lines)
+
+#---------------------------------------------------------------------------------------------------
+# sends a response to cloudformation
+def cfn_send(event, context, responseStatus, responseData={}, physicalResourceId=None, noEcho=False, reason=None):
+
+    responseUrl = event['ResponseURL']
+
+    responseBody = {}
+    responseBody['Status'] = responseStatus
+    responseBody['Reason'] = reason or ('See the details in CloudWatch Log Stream: ' + context.log_stream_name)
+    responseBody['PhysicalResourceId'] = physicalResourceId or context.log_stream_name
+    responseBody['StackId'] = event['StackId']
+    responseBody['RequestId'] = event['RequestId']
+    responseBody['LogicalResourceId'] = event['LogicalResourceId']
+    responseBody['NoEcho'] = noEcho
+    responseBody['Data'] = responseData
+
+    body = json.dumps(responseBody)
+    logger.info("| response body:\n" + body)
+
+    headers = {
+        'content-type' : '',
+        'content-length' : str(len(body))
+    }
+
+    try:
+        request = Request(responseUrl, method='PUT', data=bytes(body.encode('utf-8')), headers=headers)
+        with contextlib.closing(urlopen(request)) as response:
+            logger.info("| status code: " + response.reason)
+    except Exception as e:
+        logger.error("| unable to send response to CloudFormation")
+        logger.exception(e)
+
+
+#---------------------------------------------------------------------------------------------------
+# check if bucket is owned by a custom resource
+# if it is then we don't want to delete content
+def bucket_owned(bucketName, keyPrefix):
+    tag = CUSTOM_RESOURCE_OWNER_TAG
+    if keyPrefix != "":
+        tag = tag + ':' + keyPrefix
+    try:
+        request = s3.get_bucket_tagging(
+            Bucket=bucketName,
+        )
+        return any((x["Key"].startswith(tag)) for x in request["TagSet"])
+    except Exception as e:
+        logger.info("| error getting tags from bucket")
+        logger.exception(e)
+        return False
+
+# extract archive and replace markers in output files
+def extract_and_replace_markers(archive, contents_dir, markers, markers_config, metrics=None):
+    metrics = metrics or DeployMetrics()
+    with ZipFile(archive, "r") as zip:
+        with metrics.phase("Extract"):
+            zip.extractall(contents_dir)
+        files = [info for info in zip.infolist() if not info.is_dir()]
+        metrics.add("FilesExtracted", len(files))
+        metrics.add("BytesExtracted", sum(info.file_size for info in files))
+
+        # replace markers for this source
+        with metrics.phase("ReplaceMarkers"):
+            for file in zip.namelist():
+                file_path = os.path.join(contents_dir, file)
+                if os.path.isdir(file_path): continue
+                replace_markers(file_path, markers, markers_config)
+
+def prepare_json_safe_markers(markers):
+    """Pre-process markers to ensure JSON-safe values"""
+    safe_markers = {}
+    for key, value in markers.items():
+        # Serialize the value as JSON to handle escaping if the value is a string
+        serialized = json.dumps(value)
+        if serialized.startswith('"') and serialized.endswith('"'):
+            json_safe_value = json.dumps(value)[1:-1]  # Remove surrounding quotes
+        else:
+            json_safe_value = serialized
+        safe_markers[key.encode('utf-8')] = json_safe_value.encode('utf-8')
+    return safe_markers
+
+def replace_markers(filename, markers, markers_config):
+    """Replace markers in a file, with special handling for JSON files."""
+    # if there are no markers, skip
+    if not markers:
+        return
+    
+    outfile = filename + '.new'
+    json_escape = markers_config.get('jsonEscape', 'false').lower()
+    if json_escape == 'true':
+        replace_tokens = prepare_json_safe_markers(markers)
+    else:
+        replace_tokens = dict([(k.encode('utf-8'), v.encode('utf-8')) for k, v in markers.items()])
+
+    # Handle content with line-by-line binary replacement
+    with open(filename, 'rb') as fi, open(outfile, 'wb') as fo:
+        # Process line by line to handle large files
+        for line in fi:
+            for token, replacement in replace_tokens.items():
+                line = line.replace(token, replacement)
+            fo.write(line)
+
+    # Delete the original file and rename the new one to the original
+    os.remove(filename)
+    os.rename(outfile, filename)
+
+def replace_markers_in_json(json_object, replace_tokens):
+    """Replace markers in JSON content with proper escaping."""
+    try:
+        def replace_in_structure(obj):
+            if isinstance(obj, str):
+                # Convert string to bytes for consistent replacement
+                result = obj.encode('utf-8')
+                for token, replacement in replace_tokens.items():
+                    result = result.replace(token, replacement)
+                # Convert back to string
+                return result.decode('utf-8')
+            elif isinstance(obj, dict):
+                return {k: replace_in_structure(v) for k, v in obj.items()}
+            elif isinstance(obj, list):
+                return [replace_in_structure(item) for item in obj]
+            return obj
+
+        # Process the whole structure
+        processed = replace_in_structure(json_object)
+        return json.dumps(processed)
+    except Exception as e:
+        logger.error(f'Error processing JSON: {e}')
+        logger.exception(e)
+        return json_object
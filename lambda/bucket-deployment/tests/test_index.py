@@ -0,0 +1,284 @@
+import fnmatch
+import gzip
+import os
+import random
+import shutil
+import string
+import time
+import zipfile
+
+import pytest
+
+import index
+
+
+class FakeS3:
+    """Directory-backed destination that syncs like the aws cli: upload when the size differs or the
+    local file is newer than the object."""
+
+    def __init__(self, root):
+        self.root = root
+        self.puts = []
+        self.cache_control = {}
+        self.content_encoding = {}
+
+    def path(self, url):
+        return os.path.join(self.root, url[len("s3://"):])
+
+    def aws_command(self, *args):
+        self.aws_command_output(*args)
+
+    def aws_command_output(self, *args):
+        if args[:2] == ("s3", "cp"):
+            shutil.copyfile(self.path(args[2]), args[3])
+            return ""
+        assert args[:2] == ("s3", "sync"), args
+        rest = list(args[2:])
+        # the two paths come right after the --delete/--exclude/--include options
+        source, dest = [a for i, a in enumerate(rest)
+                        if not a.startswith("--") and (i == 0 or rest[i - 1] not in ("--exclude", "--include"))][:2]
+        option = lambda name: rest[rest.index(name) + 1] if name in rest else None
+        bucket_dir = self.path(dest)
+        lines = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                local = os.path.join(root, name)
+                rel = os.path.relpath(local, source).replace(os.sep, "/")
+                remote = os.path.join(bucket_dir, rel)
+                if os.path.exists(remote) and os.path.getsize(remote) == os.path.getsize(local) \
+                        and os.path.getmtime(local) <= os.path.getmtime(remote):
+                    continue
+                os.makedirs(os.path.dirname(remote), exist_ok=True)
+                shutil.copyfile(local, remote)  # object LastModified is the upload time
+                self.puts.append(rel)
+                self.cache_control[rel] = option("--cache-control")
+                self.content_encoding[rel] = option("--content-encoding")
+                lines.append("upload: %s to %s/%s" % (local, dest.rstrip("/"), rel))
+        return "\n".join(lines)
+
+    def list_object_etags(self, s3_dest):
+        bucket, prefix = index.split_s3_dest(s3_dest)
+        etags = {}
+        for root, _, files in os.walk(os.path.join(self.root, bucket)):
+            for name in files:
+                full = os.path.join(root, name)
+                etags[os.path.relpath(full, os.path.join(self.root, bucket)).replace(os.sep, "/")] = index.local_etag(full)
+        return etags
+
+
+@pytest.fixture
+def fake_s3(tmp_path, monkeypatch):
+    fake = FakeS3(str(tmp_path / "s3"))
+    os.makedirs(fake.path("s3://src"))
+    os.makedirs(fake.path("s3://site"))
+    monkeypatch.setattr(index, "aws_command", fake.aws_command)
+    monkeypatch.setattr(index, "aws_command_output", fake.aws_command_output)
+    monkeypatch.setattr(index, "list_object_etags", fake.list_object_etags)
+    monkeypatch.setenv(index.ENV_KEY_MOUNT_PATH, str(tmp_path))
+    return fake
+
+
+def write_archive(fake, files):
+    with zipfile.ZipFile(fake.path("s3://src/site.zip"), "w") as zf:
+        for name, body in files.items():
+            zf.writestr(name, body)
+
+
+def deploy(skip_unchanged=True, metadata_rules=[], precompress_encoding=None):
+    return index.s3_deploy(["s3://src/site.zip"], "s3://site/web", {}, {}, True, [], [], [{}], True, [{}],
+                           track_changes=True, metadata_rules=metadata_rules, skip_unchanged=skip_unchanged,
+                           precompress_encoding=precompress_encoding)
+
+
+SITE = {"index.html": "<html>home</html>", "assets/app.js": "console.log(1)", "assets/app.css": "body{}"}
+
+
+def test_redeploying_the_same_archive_changes_nothing(fake_s3):
+    write_archive(fake_s3, SITE)
+    assert deploy(skip_unchanged=False) == ["web/assets/app.css", "web/assets/app.js", "web/index.html"]
+
+    time.sleep(0.01)
+    assert deploy() == []
+
+
+def test_only_changed_files_are_uploaded(fake_s3):
+    write_archive(fake_s3, SITE)
+    deploy(skip_unchanged=False)
+
+    # same size, different content: size and mtime alone would not catch it
+    write_archive(fake_s3, dict(SITE, **{"assets/app.js": "console.log(2)"}))
+    time.sleep(0.01)
+    assert deploy() == ["web/assets/app.js"]
+
+
+def test_without_skip_unchanged_everything_is_uploaded(fake_s3):
+    write_archive(fake_s3, SITE)
+    deploy(skip_unchanged=False)
+    time.sleep(0.01)
+    assert len(deploy(skip_unchanged=False)) == 3
+
+
+def test_local_etag_matches_s3_formats(tmp_path):
+    small = tmp_path / "small"
+    small.write_bytes(b"hello")
+    assert index.local_etag(str(small)) == "5d41402abc4b2a76b9719d911017c592"
+
+    big = tmp_path / "big"
+    big.write_bytes(b"a" * (index.CLI_MULTIPART_CHUNKSIZE + 1))
+    assert index.local_etag(str(big)).endswith("-2")
+
+
+def test_plan_invalidation_paths_lists_few_changes_individually():
+    assert index.plan_invalidation_paths(["site/app.js", "site/docs/index.html"], "site/") == [
+        "/site/app.js", "/site/docs/", "/site/docs/index.html"]
+
+
+def test_plan_invalidation_paths_collapses_busy_directories():
+    keys = ["site/img/%d.png" % i for i in range(5)] + ["site/app.js"]
+    assert index.plan_invalidation_paths(keys, "site") == ["/site/app.js", "/site/img/*"]
+
+
+def test_plan_invalidation_paths_collapses_nested_wildcards_upwards():
+    keys = ["site/assets/d%d/f%d.js" % (d, f) for d in range(5) for f in range(5)]
+    assert index.plan_invalidation_paths(keys, "site") == ["/site/assets/*"]
+
+
+def test_plan_invalidation_paths_falls_back_to_the_prefix_over_budget():
+    # 4000 files over 40 directories: 40 wildcards is over the wildcard budget
+    keys = ["site/d%02d/f%03d.js" % (d, f) for d in range(40) for f in range(100)]
+    assert index.plan_invalidation_paths(keys, "site") == ["/site/*"]
+
+    keys = ["site/f%03d.js" % f for f in range(index.INVALIDATION_PATH_BUDGET + 1)]
+    assert index.plan_invalidation_paths(keys, "site") == ["/site/*"]
+
+
+def test_plan_invalidation_paths_root_prefix_and_quoting():
+    assert index.plan_invalidation_paths(["index.html", "how to style.html"], "") == [
+        "/", "/how%20to%20style.html", "/index.html"]
+    assert index.plan_invalidation_paths([], "") == []
+
+
+def test_parse_sync_output():
+    output = "\n".join([
+        "upload: ../contents/index.html to s3://b/site/index.html",
+        "upload: ../contents/how to style.html to s3://b/site/how to style.html",
+        "copy: s3://a/x.js to s3://b/site/x.js",
+        "delete: s3://b/site/old/gone.css",
+        "warning: Skipping file /tmp/contents/link. File does not exist.",
+        "",
+    ])
+    uploaded, deleted = index.parse_sync_output(output)
+    assert uploaded == {"site/index.html", "site/how to style.html", "site/x.js"}
+    assert deleted == {"site/old/gone.css"}
+
+
+def test_parse_sync_output_key_containing_to_s3():
+    uploaded, _ = index.parse_sync_output("upload: ../contents/go to s3 guide.txt to s3://b/go to s3 guide.txt")
+    assert uploaded == {"go to s3 guide.txt"}
+
+
+BASE64URL = string.ascii_letters + string.digits + "_-"
+
+
+def test_is_fingerprinted_random_rollup_hashes():
+    rng = random.Random(1)
+    for _ in range(5000):
+        digest = "".join(rng.choice(BASE64URL) for _ in range(8))
+        assert index.is_fingerprinted("assets/index-%s.js" % digest), digest
+        assert index.is_fingerprinted("assets/vendor-react-%s.css" % digest), digest
+
+
+def test_is_fingerprinted_random_webpack_hashes():
+    rng = random.Random(1)
+    for length in (8, 20, 32):
+        for _ in range(1000):
+            digest = "%0*x" % (length, rng.getrandbits(length * 4))
+            assert index.is_fingerprinted("static/js/main.%s.js" % digest), digest
+
+
+@pytest.mark.parametrize("name", [
+    "logo-2024spring.png",
+    "hero-banner2024.jpg",
+    "lookbook-fall2025v2.jpg",
+    "app.js",
+    "favicon.ico",
+    "index.html",
+])
+def test_is_not_fingerprinted(name):
+    assert not index.is_fingerprinted(name)
+
+
+def test_content_aware_caching_rules():
+    rules = index.default_metadata_rules()
+    cache_control = lambda key: (index.match_metadata_rule(key, rules) or {}).get('SystemMetadata', {}).get('cache-control')
+    assert cache_control("index.html") == index.NO_CACHE_CONTROL
+    assert cache_control("assets/index-BxY3z9aQ.js") == index.IMMUTABLE_CACHE_CONTROL
+    # hashed-looking names outside the bundler output, and plain names inside it, keep the defaults
+    assert cache_control("images/index-BxY3z9aQ.js") is None
+    assert cache_control("assets/logo-2024spring.png") is None
+    assert cache_control("vendor-react18x.js") is None
+
+
+def test_metadata_rules_upload_each_file_once_with_its_headers(fake_s3):
+    write_archive(fake_s3, dict(SITE, **{"assets/index-BxY3z9aQ.js": "export{}"}))
+    deploy(skip_unchanged=False, metadata_rules=index.default_metadata_rules())
+
+    assert sorted(fake_s3.puts) == ["assets/app.css", "assets/app.js", "assets/index-BxY3z9aQ.js", "index.html"]
+    assert fake_s3.cache_control == {
+        "index.html": index.NO_CACHE_CONTROL,
+        "assets/index-BxY3z9aQ.js": index.IMMUTABLE_CACHE_CONTROL,
+        "assets/app.js": None,
+        "assets/app.css": None,
+    }
+
+
+def test_metadata_rules_upload_entry_points_last(fake_s3):
+    write_archive(fake_s3, {
+        "index.html": "<html>home</html>",
+        "about/index.html": "<html>about</html>",
+        "assets/index-BxY3z9aQ.js": "export{}",
+        "assets/index-Cq1_x-7Z.css": "body{}",
+        "robots.txt": "User-agent: *",
+    })
+    deploy(skip_unchanged=False, metadata_rules=index.default_metadata_rules())
+
+    assert sorted(fake_s3.puts[-2:]) == ["about/index.html", "index.html"]
+    assert sorted(fake_s3.puts[:-2]) == ["assets/index-BxY3z9aQ.js", "assets/index-Cq1_x-7Z.css", "robots.txt"]
+
+
+def test_metadata_rules_redeploy_uploads_nothing(fake_s3):
+    write_archive(fake_s3, dict(SITE, **{"assets/index-BxY3z9aQ.js": "export{}"}))
+    deploy(skip_unchanged=False, metadata_rules=index.default_metadata_rules())
+
+    time.sleep(0.01)
+    assert deploy(metadata_rules=index.default_metadata_rules()) == []
+
+
+COMPRESSIBLE_SITE = dict(SITE, **{"assets/app.js": "console.log('closet');\n" * 200, "logo.png": "\x89PNG" * 400})
+
+
+def test_precompress_stores_the_compressed_body_under_the_same_key(fake_s3):
+    write_archive(fake_s3, COMPRESSIBLE_SITE)
+    deploy(skip_unchanged=False, precompress_encoding="gzip")
+
+    with open(fake_s3.path("s3://site/web/assets/app.js"), "rb") as f:
+        assert gzip.decompress(f.read()).decode() == COMPRESSIBLE_SITE["assets/app.js"]
+    # small files and types that do not compress keep their body
+    assert fake_s3.content_encoding == {
+        "assets/app.js": "gzip", "assets/app.css": None, "index.html": None, "logo.png": None,
+    }
+
+
+def test_precompress_redeploy_uploads_nothing(fake_s3):
+    write_archive(fake_s3, COMPRESSIBLE_SITE)
+    deploy(skip_unchanged=False, precompress_encoding="gzip", metadata_rules=index.default_metadata_rules())
+
+    time.sleep(0.01)
+    assert deploy(precompress_encoding="gzip", metadata_rules=index.default_metadata_rules()) == []
+
+
+def test_precompress_brotli_requires_the_module(fake_s3, monkeypatch):
+    monkeypatch.setattr(index, "brotli", None)
+    write_archive(fake_s3, COMPRESSIBLE_SITE)
+    with pytest.raises(Exception, match="brotli"):
+        deploy(precompress_encoding="br")
@@ -0,0 +1,75 @@
+import { App, Stack } from "aws-cdk-lib";
+import { Match, Template } from "aws-cdk-lib/assertions";
+import * as cloudfront from "aws-cdk-lib/aws-cloudfront";
+import * as s3 from "aws-cdk-lib/aws-s3";
+import * as s3deploy from "aws-cdk-lib/aws-s3-deployment";
+
+import { SiteDeploymentConstruct } from "./SiteDeploymentConstruct";
+
+describe("SiteDeploymentConstruct", () => {
+  it("deploys with the owned python handler", () => {
+    const stack = new Stack(new App(), "TestStack");
+    new SiteDeploymentConstruct(stack, "Site", {
+      sources: [s3deploy.Source.data("index.html", "<html></html>")],
+      destinationBucket: new s3.Bucket(stack, "WebBucket"),
+    });
+    const template = Template.fromStack(stack);
+
+    template.hasResourceProperties("AWS::Lambda::Function", {
+      Handler: "index.handler",
+      Runtime: "python3.11",
+      Timeout: 900,
+    });
+    template.hasResourceProperties("Custom::SiteDeployment", {
+      Prune: "true",
+      RetainOnDelete: "true",
+      SkipUnchangedObjects: "true",
+      TargetedInvalidation: "false",
+      ContentAwareCaching: "false",
+      MetadataRules: [],
+    });
+  });
+
+  it("passes invalidation, metadata and pre-compression settings to the handler", () => {
+    const stack = new Stack(new App(), "TestStack");
+    const distribution = cloudfront.Distribution.fromDistributionAttributes(stack, "Distribution", {
+      distributionId: "E2EXAMPLE",
+      domainName: "d111111abcdef8.cloudfront.net",
+    });
+    new SiteDeploymentConstruct(stack, "Site", {
+      sources: [s3deploy.Source.data("index.html", "<html></html>")],
+      destinationBucket: new s3.Bucket(stack, "WebBucket"),
+      distribution,
+      targetedInvalidation: true,
+      contentAwareCaching: true,
+      precompressEncoding: "gzip",
+      metadataRules: [{ include: ["fonts/*"], systemMetadata: { "cache-control": "max-age=86400" } }],
+    });
+    const template = Template.fromStack(stack);
+
+    template.hasResourceProperties("Custom::SiteDeployment", {
+      DistributionId: "E2EXAMPLE",
+      TargetedInvalidation: "true",
+      ContentAwareCaching: "true",
+      PrecompressEncoding: "gzip",
+      MetadataRules: [
+        {
+          Include: ["fonts/*"],
+          Fingerprinted: "false",
+          SystemMetadata: { "cache-control": "max-age=86400" },
+          UserMetadata: {},
+        },
+      ],
+    });
+    template.hasResourceProperties("AWS::IAM::Policy", {
+      PolicyDocument: {
+        Statement: Match.arrayWith([
+          Match.objectLike({
+            Action: ["cloudfront:CreateInvalidation", "cloudfront:GetInvalidation"],
+            Effect: "Allow",
+          }),
+        ]),
+      },
+    });
+  });
+});
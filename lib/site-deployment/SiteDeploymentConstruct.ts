@@ -0,0 +1,154 @@
+import { Construct } from "constructs";
+import * as cdk from "aws-cdk-lib";
+import * as lambda from "aws-cdk-lib/aws-lambda";
+import * as iam from "aws-cdk-lib/aws-iam";
+import * as s3 from "aws-cdk-lib/aws-s3";
+import * as s3deploy from "aws-cdk-lib/aws-s3-deployment";
+import * as cloudfront from "aws-cdk-lib/aws-cloudfront";
+import { AwsCliLayer } from "aws-cdk-lib/lambda-layer-awscli";
+import * as path from "path";
+
+/**
+ * Per-file metadata, first matching rule wins (keys relative to the destination prefix).
+ * A rule matches when the key matches one of its globs (if given) and, with
+ * `fingerprinted`, its name carries a bundler content hash.
+ */
+export interface SiteMetadataRule {
+  /** Globs, e.g. ["assets/*"]; "*" also matches "/" like `aws s3 sync` filters */
+  include?: string[];
+  /**
+   * Only names with a webpack hex or vite/rollup hash, e.g. "index-BxY3z9aQ.js"; any 8-char
+   * "-xxxxxxxx" segment counts, so limit the rule to the bundler's output with `include`
+   */
+  fingerprinted?: boolean;
+  /** e.g. { "cache-control": "public, max-age=31536000, immutable" } */
+  systemMetadata?: Record<string, string>;
+  userMetadata?: Record<string, string>;
+}
+
+export interface SiteDeploymentConstructProps {
+  sources: s3deploy.ISource[];
+  destinationBucket: s3.IBucket;
+  destinationKeyPrefix?: string;
+
+  distribution?: cloudfront.IDistribution;
+  /** Explicit invalidation paths; default is "/<prefix>/*" (or the planned paths, see targetedInvalidation) */
+  distributionPaths?: string[];
+  waitForInvalidation?: boolean;
+  /** Invalidate only what the sync changed; skip invalidation when nothing changed */
+  targetedInvalidation?: boolean;
+
+  prune?: boolean;
+  /** Keep objects whose content already matches (MD5/ETag) instead of re-uploading them; default true */
+  skipUnchangedObjects?: boolean;
+  retainOnDelete?: boolean;
+  exclude?: string[];
+  include?: string[];
+
+  /** Applied to every object unless a metadata rule overrides it */
+  systemMetadata?: Record<string, string>;
+  userMetadata?: Record<string, string>;
+  metadataRules?: SiteMetadataRule[];
+  /** Built-in rules: HTML no-cache, fingerprinted files under assets/ immutable for a year */
+  contentAwareCaching?: boolean;
+  /**
+   * Store compressible files (js, css, html, json, svg, ...) of 1 KiB or more compressed, under their
+   * own key with this Content-Encoding. Every client gets the compressed body, which is what
+   * browsers expect; the distribution must not compress again (CACHING_DISABLED does not).
+   * "br" needs the brotli module in the handler (e.g. from a layer).
+   */
+  precompressEncoding?: "gzip" | "br";
+
+  memoryLimit?: number;
+}
+
+const bool = (v: boolean | undefined, fallback: boolean) =>
+  (v ?? fallback) ? "true" : "false";
+
+/**
+ * BucketDeployment equivalent backed by the handler in lambda/bucket-deployment,
+ * which adds targeted invalidation, per-file metadata and deploy metrics.
+ *
+ * Library only for now: no stack instantiates it. The site is still deployed by
+ * .github/workflows/deploy.yml and deploy-frontend.yml (plain `aws s3 sync` and a
+ * "/*" invalidation). Using it from WebStack needs site/dist at synth time, which the
+ * preflight `cdk synth` does not build; the workflow sync and invalidation must be
+ * removed in the same change.
+ */
+export class SiteDeploymentConstruct extends Construct {
+  public readonly handler: lambda.SingletonFunction;
+  public readonly resource: cdk.CustomResource;
+
+  constructor(scope: Construct, id: string, props: SiteDeploymentConstructProps) {
+    super(scope, id);
+
+    this.handler = new lambda.SingletonFunction(this, "Handler", {
+      uuid: "5f0c7a52-3c1e-4f7e-9a7d-2b6f3d8e41a9",
+      lambdaPurpose: "SiteDeployment",
+      runtime: lambda.Runtime.PYTHON_3_11,
+      handler: "index.handler",
+      code: lambda.Code.fromAsset(
+        path.join(process.cwd(), "lambda/bucket-deployment"),
+        { exclude: ["tests", "__pycache__"] }
+      ),
+      layers: [new AwsCliLayer(this, "AwsCliLayer")],
+      timeout: cdk.Duration.minutes(15),
+      memorySize: props.memoryLimit ?? 512,
+      description: "Deploys site archives to S3 and invalidates CloudFront",
+    });
+
+    const role = this.handler.role!;
+    const sources = props.sources.map((s) => s.bind(this, { handlerRole: role }));
+
+    props.destinationBucket.grantReadWrite(this.handler);
+    this.handler.addToRolePolicy(
+      new iam.PolicyStatement({
+        actions: ["s3:GetBucketTagging"],
+        resources: [props.destinationBucket.bucketArn],
+      })
+    );
+    if (props.distribution) {
+      this.handler.addToRolePolicy(
+        new iam.PolicyStatement({
+          actions: ["cloudfront:CreateInvalidation", "cloudfront:GetInvalidation"],
+          resources: ["*"],
+        })
+      );
+    }
+
+    this.resource = new cdk.CustomResource(this, "CustomResource", {
+      serviceToken: this.handler.functionArn,
+      resourceType: "Custom::SiteDeployment",
+      properties: {
+        SourceBucketNames: sources.map((s) => s.bucket.bucketName),
+        SourceObjectKeys: sources.map((s) => s.zipObjectKey),
+        SourceMarkers: sources.map((s) => s.markers ?? {}),
+        SourceMarkersConfig: sources.map((s) => ({
+          jsonEscape: bool(s.markersConfig?.jsonEscape, false),
+        })),
+        DestinationBucketName: props.destinationBucket.bucketName,
+        DestinationBucketArn: props.destinationBucket.bucketArn,
+        DestinationBucketKeyPrefix: props.destinationKeyPrefix,
+        RetainOnDelete: bool(props.retainOnDelete, true),
+        Prune: bool(props.prune, true),
+        SkipUnchangedObjects: bool(props.skipUnchangedObjects, true),
+        Exclude: props.exclude,
+        Include: props.include,
+        UserMetadata: props.userMetadata ?? {},
+        SystemMetadata: props.systemMetadata ?? {},
+        MetadataRules: (props.metadataRules ?? []).map((r) => ({
+          Include: r.include ?? [],
+          Fingerprinted: bool(r.fingerprinted, false),
+          SystemMetadata: r.systemMetadata ?? {},
+          UserMetadata: r.userMetadata ?? {},
+        })),
+        ContentAwareCaching: bool(props.contentAwareCaching, false),
+        PrecompressEncoding: props.precompressEncoding,
+        DistributionId: props.distribution?.distributionId,
+        DistributionPaths: props.distributionPaths,
+        WaitForDistributionInvalidation: props.waitForInvalidation ?? true,
+        TargetedInvalidation: bool(props.targetedInvalidation, false),
+      },
+    });
+  }
+}
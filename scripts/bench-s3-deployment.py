@@ -0,0 +1,457 @@
+"""
+Offline benchmark for the S3 bucket-deployment custom resource handler.
+
+Generates synthetic site archives, runs `s3_deploy` against a local
+directory standing in for S3 (`aws_command` / `aws_command_output` and the
+object listing are replaced by fakes) and reports wall time, peak disk use,
+peak RSS, request counts and the handler's own phase timings.
+
+The fake sync decides like the aws cli: a file is uploaded when the object
+is missing, its size differs or the local file is newer than the object.
+Scenarios with "redeploy" deploy the same archive twice and measure only
+the second deploy (an Update with unchanged content). Archives are built in
+a separate worker process: a spawned child starts with its parent's peak
+RSS on Linux, so neither the parent nor the measured process may build
+them. The measured process only imports the handler and runs `s3_deploy`.
+
+The committed baseline was recorded at full scale on a 1 vCPU Linux x86_64
+sandbox (Python 3.11) with local disk standing in for S3; only compare runs
+from comparable machines, or record a local baseline with --save-baseline.
+
+Usage:
+  python scripts/bench-s3-deployment.py                     # run, compare with baseline if present
+  python scripts/bench-s3-deployment.py --save-baseline     # run and store the results as the baseline
+  python scripts/bench-s3-deployment.py --quick --only small-files
+
+Requires boto3 (imported by the handler module); no AWS credentials or
+network access are used.
+"""
+
+import argparse
+import concurrent.futures
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "scripts", "bench-s3-deployment.baseline.json")
+
+KIB = 1024
+MIB = 1024 * KIB
+
+# name -> (groups of (file count, file size), marker count)
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "small-files": {"files": [(5000, 1 * KIB)], "markers": 0},
+    "small-files-markers": {"files": [(5000, 1 * KIB)], "markers": 20},
+    "mixed-site": {"files": [(500, 32 * KIB), (50, 512 * KIB)], "markers": 5},
+    "huge-bundles": {"files": [(3, 48 * MIB)], "markers": 5},
+    "huge-bundles-many-markers": {"files": [(3, 48 * MIB)], "markers": 100},
+    "redeploy-unchanged": {"files": [(500, 32 * KIB), (50, 512 * KIB)], "markers": 5, "redeploy": True},
+    # built-in rules: per-batch staging (hard links) and one sync per batch
+    "content-aware-caching": {"files": [(500, 32 * KIB), (50, 512 * KIB)], "markers": 5, "contentAwareCaching": True},
+    "precompress-gzip": {"files": [(500, 32 * KIB), (50, 512 * KIB)], "markers": 5, "precompress": "gzip"},
+}
+
+# compared against the baseline, with the threshold (ratio) above which a change is flagged
+COMPARED_FIELDS = {"wallSeconds": 1.10, "peakRssBytes": 1.10, "peakDiskBytes": 1.05}
+
+
+def find_handler_module() -> str:
+    path = os.path.join(REPO_ROOT, "lambda", "bucket-deployment", "index.py")
+    if not os.path.exists(path):
+        raise SystemExit(f"bucket-deployment handler not found: {path}")
+    return path
+
+
+def load_handler(path: str):
+    # boto3 clients are created at import time and need a region, never credentials
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    spec = importlib.util.spec_from_file_location("bucket_deployment_handler", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)  # type: ignore[union-attr]
+    return module
+
+
+# ---------------------------------------------------------------------------
+# synthetic archives
+
+
+def _text_block(size: int, tokens: List[str], rng: random.Random) -> bytes:
+    """Compressible text of roughly `size` bytes with the marker tokens sprinkled through it."""
+    words = ["closet", "lala", "bestie", "style", "look", "episode", "const", "return", "function", "div"]
+    lines = []
+    total = 0
+    while total < size:
+        line = " ".join(rng.choice(words) for _ in range(12))
+        if tokens and rng.random() < 0.2:
+            line += " " + rng.choice(tokens)
+        lines.append(line)
+        total += len(line) + 1
+    return ("\n".join(lines) + "\n").encode("utf-8")[:size]
+
+
+def build_archive(path: str, scenario: Dict[str, Any], seed: int = 1) -> Dict[str, str]:
+    rng = random.Random(seed)
+    markers = {f"<<marker:0x{i:04x}>>": f"value-{i}" for i in range(scenario["markers"])}
+    tokens = list(markers)
+
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("index.html", _text_block(4 * KIB, tokens, rng))
+        for group, (count, size) in enumerate(scenario["files"]):
+            for i in range(count):
+                ext = rng.choice([".js", ".css", ".json", ".html"])
+                name = f"assets/g{group}/d{i % 50}/file-{i:05d}-{rng.getrandbits(32):08x}{ext}"
+                zf.writestr(name, _text_block(size, tokens, rng))
+    return markers
+
+
+# ---------------------------------------------------------------------------
+# local S3 stand-in
+
+
+class LocalS3:
+    """Maps s3://bucket/key onto <root>/bucket/key and counts requests like the CLI would issue them."""
+
+    def __init__(self, root: str, is_synced, local_etag):
+        self.root = root
+        self.is_synced = is_synced
+        self.local_etag = local_etag
+        self.requests: Dict[str, int] = {}
+
+    def count(self, kind: str, n: int = 1) -> None:
+        self.requests[kind] = self.requests.get(kind, 0) + n
+
+    def local_path(self, url: str) -> str:
+        return os.path.join(self.root, url[len("s3://"):])
+
+    def aws_command(self, *args: str) -> None:
+        self.aws_command_output(*args)
+
+    def aws_command_output(self, *args: str) -> str:
+        if args[0] == "configure":
+            return ""
+        if args[:2] == ("s3", "cp"):
+            return self._cp(args[2], args[3])
+        if args[:2] == ("s3", "sync"):
+            return self._sync(list(args[2:]))
+        raise RuntimeError(f"unsupported fake aws command: {args!r}")
+
+    def _cp(self, source: str, dest: str) -> str:
+        self.count("GetObject")
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(source))
+        shutil.copyfile(self.local_path(source), dest)
+        return f"download: {source} to {dest}"
+
+    def _sync(self, args: List[str]) -> str:
+        exclude: List[str] = []
+        include: List[str] = []
+        positional: List[str] = []
+        delete = False
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "--delete":
+                delete = True
+            elif arg == "--exclude":
+                exclude.append(args[i + 1])
+                i += 1
+            elif arg == "--include":
+                include.append(args[i + 1])
+                i += 1
+            elif arg.startswith("--") and arg != "--no-progress":
+                i += 1  # metadata flags take a value
+            elif not arg.startswith("--"):
+                positional.append(arg)
+            i += 1
+        source, dest = positional
+        bucket_dir = self.local_path(dest)
+
+        def walk(root: str) -> Dict[str, str]:
+            found = {}
+            for dirpath, _, files in os.walk(root):
+                for name in files:
+                    full = os.path.join(dirpath, name)
+                    found[os.path.relpath(full, root).replace(os.sep, "/")] = full
+            return found
+
+        local = walk(source)
+        remote = walk(bucket_dir) if os.path.isdir(bucket_dir) else {}
+        self.count("ListObjectsV2", max(1, (len(remote) + 999) // 1000))
+
+        dest_url = dest.rstrip("/")
+        lines = []
+        for rel, full in sorted(local.items()):
+            if not self.is_synced(rel, exclude, include):
+                continue
+            target = os.path.join(bucket_dir, rel)
+            if rel in remote and os.path.getsize(target) == os.path.getsize(full) \
+                    and os.path.getmtime(full) <= os.path.getmtime(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(full, target)  # the object's LastModified is the upload time
+            self.count("PutObject")
+            lines.append(f"upload: {full} to {dest_url}/{rel}")
+        if delete:
+            for rel, full in sorted(remote.items()):
+                if rel not in local and self.is_synced(rel, exclude, include):
+                    os.remove(full)
+                    self.count("DeleteObject")
+                    lines.append(f"delete: {dest_url}/{rel}")
+        return "\n".join(lines)
+
+    def list_object_etags(self, s3_dest: str) -> Dict[str, str]:
+        bucket, _, prefix = s3_dest[len("s3://"):].partition("/")
+        bucket_dir = os.path.join(self.root, bucket)
+        etags = {}
+        for dirpath, _, files in os.walk(os.path.join(bucket_dir, prefix)):
+            for name in files:
+                full = os.path.join(dirpath, name)
+                etags[os.path.relpath(full, bucket_dir).replace(os.sep, "/")] = self.local_etag(full)
+        self.count("ListObjectsV2", max(1, (len(etags) + 999) // 1000))
+        return etags
+
+
+class DiskSampler(threading.Thread):
+    """Polls the size of a directory tree and keeps the peak; hard links are counted once."""
+
+    def __init__(self, root: str, interval: float = 0.05):
+        super().__init__(daemon=True)
+        self.root = root
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def _size(self) -> int:
+        total = 0
+        seen = set()
+        stack = [self.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        stat = entry.stat(follow_symlinks=False)
+                        if (stat.st_dev, stat.st_ino) not in seen:
+                            seen.add((stat.st_dev, stat.st_ino))
+                            total += stat.st_size
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def run(self) -> None:
+        while not self._done.is_set():
+            self.peak = max(self.peak, self._size())
+            self._done.wait(self.interval)
+
+    def stop(self) -> int:
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, self._size())
+        return self.peak
+
+
+# ---------------------------------------------------------------------------
+# runner
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak RSS (VmHWM) to the current RSS; Linux only, returns False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes(reset: bool) -> int:
+    """Peak RSS since reset_peak_rss() if it succeeded, otherwise for the process lifetime (ru_maxrss)."""
+    if reset:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * KIB
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else KIB)
+
+
+def scale_scenario(name: str, scale: float) -> Dict[str, Any]:
+    scenario = dict(SCENARIOS[name])
+    scenario["files"] = [(max(1, int(count * scale)), size) for count, size in scenario["files"]]
+    return scenario
+
+
+def run_scenario(handler_path: str, name: str, scale: float, root: str, markers: Dict[str, str], queue) -> None:
+    """Runs one scenario in a fresh process, so the peak RSS reflects only this deploy."""
+    from unittest import mock
+
+    scenario = scale_scenario(name, scale)
+    handler = load_handler(handler_path)
+
+    s3_root = os.path.join(root, "s3")
+    archive = os.path.join(s3_root, "source-bucket", "asset.zip")
+    metadata_rules = handler.default_metadata_rules() if scenario.get("contentAwareCaching") else []
+
+    # the handler creates its workdir under MOUNT_PATH, which is what the disk sampler watches
+    workdir_root = os.path.join(root, "work")
+    os.makedirs(workdir_root)
+    os.environ[handler.ENV_KEY_MOUNT_PATH] = workdir_root
+    os.environ.pop(handler.ENV_KEY_SKIP_CLEANUP, None)
+
+    fake = LocalS3(s3_root, handler.is_synced, handler.local_etag)
+
+    def deploy(metrics, skip_unchanged):
+        handler.s3_deploy(
+            ["s3://source-bucket/asset.zip"], "s3://site-bucket/", {}, {}, True, [], [],
+            [markers], True, [{}], metadata_rules=metadata_rules, metrics=metrics,
+            skip_unchanged=skip_unchanged, precompress_encoding=scenario.get("precompress"))
+
+    with mock.patch.object(handler, "aws_command", fake.aws_command), \
+            mock.patch.object(handler, "aws_command_output", fake.aws_command_output), \
+            mock.patch.object(handler, "list_object_etags", fake.list_object_etags):
+        if scenario.get("redeploy"):
+            # the initial (Create) deploy is not measured
+            deploy(handler.DeployMetrics(), False)
+            fake.requests.clear()
+            time.sleep(0.01)
+
+        metrics = handler.DeployMetrics()
+        sampler = DiskSampler(workdir_root)
+        rss_reset = reset_peak_rss()
+        rss_before = peak_rss_bytes(rss_reset)
+        sampler.start()
+        start = time.perf_counter()
+        deploy(metrics, bool(scenario.get("redeploy")))
+        wall = time.perf_counter() - start
+        peak_disk = sampler.stop()
+        peak_rss = peak_rss_bytes(rss_reset)
+
+    report = metrics.as_dict()
+    queue.put({
+        "wallSeconds": round(wall, 3),
+        "peakDiskBytes": peak_disk,
+        "peakRssBytes": peak_rss,
+        "rssBeforeDeployBytes": rss_before,
+        "archiveBytes": os.path.getsize(archive),
+        "files": sum(count for count, _ in scenario["files"]) + 1,
+        "markers": scenario["markers"],
+        "requests": dict(sorted(fake.requests.items())),
+        "filesUploaded": report.get("FilesUploaded", 0),
+        "phases": {k: v for k, v in report.items() if k.endswith("Seconds")},
+    })
+
+
+def run_all(handler_path: str, names: List[str], scale: float) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for name in names:
+        root = tempfile.mkdtemp(prefix="bench-s3-deployment-")
+        try:
+            s3_root = os.path.join(root, "s3")
+            os.makedirs(os.path.join(s3_root, "source-bucket"))
+            os.makedirs(os.path.join(s3_root, "site-bucket"))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=ctx) as builder:
+                markers = builder.submit(
+                    build_archive, os.path.join(s3_root, "source-bucket", "asset.zip"), scale_scenario(name, scale)
+                ).result()
+
+            queue = ctx.Queue()
+            process = ctx.Process(target=run_scenario, args=(handler_path, name, scale, root, markers, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        if process.exitcode != 0:
+            raise SystemExit(f"scenario {name} failed with exit code {process.exitcode}")
+        results[name] = result
+        print(f"{name:28} {result['wallSeconds']:8.3f}s  rss {result['peakRssBytes'] / MIB:7.1f} MiB  "
+              f"disk {result['peakDiskBytes'] / MIB:8.1f} MiB  requests {sum(result['requests'].values())}  "
+              f"uploaded {result['filesUploaded']}")
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> bool:
+    """Prints the change against the baseline; returns False if any field regressed past its threshold."""
+    ok = True
+    print("\ncompared with baseline (%s):" % baseline.get("created", "unknown"))
+    for name, result in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            print(f"  {name:28} no baseline")
+            continue
+        parts = []
+        for field, threshold in COMPARED_FIELDS.items():
+            if not base.get(field):
+                continue
+            ratio = result[field] / base[field]
+            flag = ""
+            if ratio > threshold:
+                flag = " !"
+                ok = False
+            parts.append(f"{field} {ratio - 1:+.1%}{flag}")
+        if result["requests"] != base.get("requests"):
+            parts.append(f"requests {base.get('requests')} -> {result['requests']}")
+        print(f"  {name:28} " + ", ".join(parts))
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handler", default=None, help="path to the handler index.py (default: lambda/bucket-deployment)")
+    parser.add_argument("--only", action="append", choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--quick", action="store_true", help="scale file counts down 10x")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    handler_path = args.handler or find_handler_module()
+    scale = 0.1 if args.quick else 1.0
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "scenarios": run_all(handler_path, args.only or list(SCENARIOS), scale),
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nbaseline written to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != scale:
+            print(f"\nbaseline was recorded with scale {baseline.get('scale')}, not comparing")
+            return 0
+        return 0 if compare(results["scenarios"], baseline) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Compares the tiled segmentation path of image-segmentation-lambda with the
+default full-resolution rembg.remove path.
+
+Each mode runs in a fresh process on the same image and reports wall time
+and peak RSS; the outputs are then compared for edge-quality parity (alpha
+difference overall and in the soft edge band, foreground IoU).
+
+With --stub-mask, rembg is replaced by a stand-in that "predicts" a fixed
+soft-edged ellipse at 320x320 (u2net's input size) and resizes it to the
+input like rembg's sessions do; the default path then composites it like
+rembg's naive cutout. This measures decode, mask upscaling, compositing and
+PNG encoding of both paths, and the parity cost of the low-res guide, but
+not model inference or how the model itself reacts to a reduced guide.
+
+Usage:
+  python scripts/bench-segmentation-tiling.py                          # Pictures/test.jpg
+  python scripts/bench-segmentation-tiling.py --image big.jpg
+  python scripts/bench-segmentation-tiling.py --upscale 6 --strip-rows 128
+  python scripts/bench-segmentation-tiling.py --upscale 6 --stub-mask  # no model needed
+
+Requires the image-segmentation-lambda dependencies (rembg, Pillow, numpy,
+onnxruntime) and boto3; the rembg model is loaded as in the Lambda
+(REMBG_MODEL_NAME, U2NET_HOME). --stub-mask needs only Pillow, numpy and boto3.
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import types
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_ROOT = os.path.join(REPO_ROOT, "image-segmentation-lambda")
+DEFAULT_IMAGE = os.path.join(REPO_ROOT, "Pictures", "test.jpg")
+
+MIB = 1024 * 1024
+
+# resolution the stand-in mask is "predicted" at, like u2net's 320x320 input
+STUB_MASK_SIDE = 320
+
+
+def _stub_predict(img):
+    """A soft-edged ellipse at STUB_MASK_SIDE, resized to the image like rembg's sessions resize their output."""
+    import numpy as np
+    from PIL import Image
+
+    axis = (np.arange(STUB_MASK_SIDE, dtype=np.float32) + 0.5) / STUB_MASK_SIDE - 0.5
+    dist = np.sqrt((axis[None, :] / 0.35) ** 2 + (axis[:, None] / 0.42) ** 2)
+    alpha = np.clip((1.0 - dist) / 0.08, 0.0, 1.0) * 255
+    mask = Image.fromarray((alpha + 0.5).astype(np.uint8), "L")
+    return mask.resize(img.size, Image.LANCZOS)
+
+
+def _stub_remove(data, session=None, only_mask=False, **kwargs):
+    """Stands in for rembg.remove: same input handling and naive cutout, stand-in mask."""
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(data)) if isinstance(data, bytes) else data
+    img = ImageOps.exif_transpose(img)
+    mask = _stub_predict(img)
+    if only_mask:
+        cutout = mask
+    else:
+        cutout = Image.composite(img, Image.new("RGBA", img.size, 0), mask)
+    if not isinstance(data, bytes):
+        return cutout
+    buf = io.BytesIO()
+    cutout.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def run_mode(mode: str, image_path: str, output_path: str, stub_mask: bool, queue) -> None:
+    """Runs one segmentation path in a fresh process so ru_maxrss reflects only that path."""
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, LAMBDA_ROOT)
+    if stub_mask:
+        sys.modules["rembg"] = types.SimpleNamespace(remove=_stub_remove)  # type: ignore[assignment]
+    from app import handler  # type: ignore
+
+    if stub_mask:
+        handler._get_rembg_session = lambda: None
+
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+
+    # Load the model before measuring, both paths share the cached session
+    handler._get_rembg_session()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if mode == "tiled":
+        out = handler._segment_background_tiled(image_bytes)
+    else:
+        out = handler._segment_background(image_bytes)
+    wall = time.perf_counter() - start
+
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    with open(output_path, "wb") as f:
+        f.write(out.getbuffer())
+    queue.put({
+        "wallSeconds": round(wall, 3),
+        "peakRssBytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit,
+        "rssBeforeBytes": rss_before * rss_unit,
+        "outputBytes": out.getbuffer().nbytes,
+    })
+
+
+def compare_alpha(default_path: str, tiled_path: str) -> Dict[str, float]:
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(default_path) as a, Image.open(tiled_path) as b:
+        if a.size != b.size:
+            raise SystemExit(f"output sizes differ: default={a.size} tiled={b.size}")
+        alpha_a = np.asarray(a.convert("RGBA"))[..., 3].astype(np.int16)
+        alpha_b = np.asarray(b.convert("RGBA"))[..., 3].astype(np.int16)
+
+    diff = np.abs(alpha_a - alpha_b)
+    # Soft edge band of the default output, where upscaling differences show up
+    edge = (alpha_a > 8) & (alpha_a < 247)
+    fg_a = alpha_a >= 128
+    fg_b = alpha_b >= 128
+    union = np.count_nonzero(fg_a | fg_b)
+    return {
+        "alphaMeanAbsDiff": round(float(diff.mean()), 4),
+        "alphaMaxAbsDiff": int(diff.max()),
+        "edgePixels": int(np.count_nonzero(edge)),
+        "edgeMeanAbsDiff": round(float(diff[edge].mean()), 4) if edge.any() else 0.0,
+        "foregroundIoU": round(np.count_nonzero(fg_a & fg_b) / union, 6) if union else 1.0,
+    }
+
+
+def prepare_image(path: str, upscale: int, workdir: str) -> str:
+    if upscale <= 1:
+        return path
+    from PIL import Image
+
+    with Image.open(path) as img:
+        big = img.convert("RGB").resize((img.width * upscale, img.height * upscale), Image.LANCZOS)
+    out = os.path.join(workdir, "input.jpg")
+    big.save(out, format="JPEG", quality=92)
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default=DEFAULT_IMAGE, help="input image")
+    parser.add_argument("--upscale", type=int, default=1, help="enlarge the input N times to simulate a very large photo")
+    parser.add_argument("--strip-rows", type=int, default=None, help="SEGMENTATION_STRIP_ROWS for the tiled path")
+    parser.add_argument("--guide-max-side", type=int, default=None, help="SEGMENTATION_GUIDE_MAX_SIDE for the tiled path")
+    parser.add_argument("--stub-mask", action="store_true", help="replace rembg with a fixed stand-in mask (no model)")
+    parser.add_argument("--keep", action="store_true", help="keep the output PNGs and print their location")
+    args = parser.parse_args(argv)
+
+    if args.strip_rows:
+        os.environ["SEGMENTATION_STRIP_ROWS"] = str(args.strip_rows)
+    if args.guide_max_side:
+        os.environ["SEGMENTATION_GUIDE_MAX_SIDE"] = str(args.guide_max_side)
+
+    workdir = tempfile.mkdtemp(prefix="bench-segmentation-")
+    try:
+        image_path = prepare_image(args.image, args.upscale, workdir)
+        ctx = multiprocessing.get_context("spawn")
+        results: Dict[str, Any] = {}
+        for mode in ("default", "tiled"):
+            queue = ctx.Queue()
+            output_path = os.path.join(workdir, f"{mode}.png")
+            process = ctx.Process(target=run_mode, args=(mode, image_path, output_path, args.stub_mask, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            if process.exitcode != 0:
+                raise SystemExit(f"{mode} path failed with exit code {process.exitcode}")
+            results[mode] = result
+            print(f"{mode:8} {result['wallSeconds']:8.3f}s  peak rss {result['peakRssBytes'] / MIB:8.1f} MiB  "
+                  f"(+{(result['peakRssBytes'] - result['rssBeforeBytes']) / MIB:.1f} MiB during segmentation)  "
+                  f"png {result['outputBytes'] / MIB:.2f} MiB")
+
+        parity = compare_alpha(os.path.join(workdir, "default.png"), os.path.join(workdir, "tiled.png"))
+        print("parity   " + ", ".join(f"{k} {v}" for k, v in parity.items()))
+        if args.keep:
+            print(f"outputs kept in {workdir}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())